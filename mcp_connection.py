@@ -0,0 +1,57 @@
+import asyncio
+import atexit
+import contextlib
+import threading
+
+import streamlit as st
+from fastmcp import Client
+
+# Streamlit re-executes its scripts on every interaction. Keep one event loop
+# and one connected FastMCP client for the whole server process (shared by all
+# sessions) so the transport isn't re-established on every click and closed
+# tabs don't each leave a server subprocess behind.
+class MCPConnection:
+    def __init__(self, server: str):
+        self.server = server
+        self.client = None
+        # The loop runs on its own thread so calls from different sessions
+        # overlap; one client session can have several requests in flight.
+        self.loop = asyncio.new_event_loop()
+        self._connect_lock = asyncio.Lock()
+        threading.Thread(target=self.loop.run_forever, name="mcp-loop", daemon=True).start()
+        atexit.register(self.close)
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def get_client(self) -> Client:
+        async with self._connect_lock:
+            if self.client is None or not self.client.is_connected():
+                if self.client is not None:
+                    with contextlib.suppress(Exception):
+                        await self.client.__aexit__(None, None, None)
+                self.client = Client(self.server)
+                await self.client.__aenter__()
+        return self.client
+
+    def close(self):
+        if self.client is not None:
+            with contextlib.suppress(Exception):
+                asyncio.run_coroutine_threadsafe(
+                    self.client.__aexit__(None, None, None), self.loop
+                ).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+@st.cache_resource
+def get_mcp_connection(server: str = "toll_server.py") -> MCPConnection:
+    return MCPConnection(server)
+
+def call_tool(name: str, arguments: dict = None):
+    """Calls a tool on the shared FastMCP client and waits for its result."""
+    connection = get_mcp_connection()
+
+    async def _call():
+        client = await connection.get_client()
+        return await client.call_tool(name, arguments)
+
+    return connection.run(_call())
@@ -3,9 +3,15 @@ import signal
 import sys
 import os
 from databricks.sdk import WorkspaceClient
-from databricks.sdk.service.sql import ExecuteStatementRequest
-from typing import List, Dict, Any
+from databricks.sdk.service.sql import Disposition, Format, StatementState
+from typing import List, Dict, Any, Optional
 import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import numpy as np
+import pyarrow as pa
+import requests
 
 mcp = FastMCP("TollServer")
 
@@ -14,6 +20,32 @@ workspace = WorkspaceClient(
     token=os.getenv("DATABRICKS_TOKEN")
 )
 
+# Statements still in one of these states after the initial server-side wait
+# are polled with exponential backoff, bounded in seconds below.
+PENDING_STATES = {StatementState.PENDING, StatementState.RUNNING}
+POLL_INITIAL_DELAY = 0.1
+POLL_MAX_DELAY = 2.0
+
+# Downloads Arrow result chunks from the presigned links Databricks returns
+_result_session = requests.Session()
+
+# Row cap for run_sql_query; the warehouse stops producing rows past it
+DEFAULT_MAX_ROWS = 1000
+
+# Process-wide Snowflake connection pool, created lazily by _get_sf_pool().
+# Blocking connector calls run on a dedicated executor of the same size so
+# they neither queue behind nor starve work on the default executor.
+SF_POOL_SIZE = int(os.getenv("SF_POOL_SIZE", "5"))
+SF_POOL: Optional[asyncio.Queue] = None
+_sf_pool_lock = asyncio.Lock()
+_SF_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=SF_POOL_SIZE, thread_name_prefix="sf")
+# ProgrammingError errnos meaning the session/master token is gone (e.g. after
+# ~4h idle); the connection can't be reused.
+_SF_SESSION_EXPIRED_ERRNOS = {390111, 390112, 390114}
+
+# Toll multipliers per vehicle type; anything else is charged at 1.0
+_TOLL_RATES = {"car": 1.0, "truck": 1.5, "motorcycle": 0.8}
+
 @mcp.tool()
 def secret_word() -> str:
     """Returns a secret word."""
@@ -22,87 +54,209 @@ def secret_word() -> str:
 @mcp.tool()
 def calculate_toll(vehicle_type: str, distance: float, toll_rate: float = 0.25) -> float:
     """Calculates toll based on vehicle type, distance, and rate."""
-    rates = {"car": 1.0, "truck": 1.5, "motorcycle": 0.8}
-    multiplier = rates.get(vehicle_type.lower(), 1.0)
+    multiplier = _TOLL_RATES.get(vehicle_type.lower(), 1.0)
     return round(distance * toll_rate * multiplier, 2)
 
 @mcp.tool()
-async def run_sql_query(query: str) -> List[Dict[str, Any]]:
-    """Runs a SQL query on Databricks SQL warehouse and returns results."""
+def calculate_tolls_batch(vehicle_types: List[str], distances: List[float], toll_rate: float = 0.25) -> List[float]:
+    """Calculates tolls for many (vehicle type, distance) pairs at the same rate."""
+    if len(vehicle_types) != len(distances):
+        raise ValueError("vehicle_types and distances must have the same length")
+    multipliers = np.fromiter(
+        (_TOLL_RATES.get(v.lower(), 1.0) for v in vehicle_types),
+        dtype=np.float64,
+        count=len(vehicle_types)
+    )
+    tolls = np.asarray(distances, dtype=np.float64) * toll_rate * multipliers
+    # Round with Python's round() to match calculate_toll exactly; np.round
+    # scales by 100 and rounds half-to-even, which disagrees on some inputs.
+    return [round(toll, 2) for toll in tolls.tolist()]
+
+def _fetch_arrow_result(statement) -> Optional[pa.Table]:
+    """Downloads every ARROW_STREAM chunk of a finished statement into one table."""
+    batches = []
+    result = statement.result
+    while result is not None:
+        for link in result.external_links or []:
+            # These headers can carry storage decryption keys; never log them
+            response = _result_session.get(link.external_link, headers=link.http_headers or {}, timeout=60)
+            response.raise_for_status()
+            batches.extend(pa.ipc.open_stream(response.content))
+        if result.next_chunk_index is None:
+            break
+        result = workspace.statement_execution.get_statement_result_chunk_n(
+            statement.statement_id, result.next_chunk_index
+        )
+    return pa.Table.from_batches(batches) if batches else None
+
+@mcp.tool()
+async def run_sql_query(query: str, max_rows: int = DEFAULT_MAX_ROWS) -> Dict[str, Any]:
+    """
+    Runs a SQL query on Databricks SQL warehouse and returns results.
+    Returns {"rows": [...], "truncated": bool}; at most max_rows rows are
+    returned and truncated is set when the query produced more.
+    """
     try:
         warehouse_id = os.getenv("DATABRICKS_SQL_WAREHOUSE_ID")
         if not warehouse_id:
             raise ValueError("DATABRICKS_SQL_WAREHOUSE_ID not set")
 
-        statement = workspace.statement_execution.execute_statement(
-            ExecuteStatementRequest(
-                warehouse_id=warehouse_id,
+        loop = asyncio.get_running_loop()
+
+        # Let the warehouse hold the request open for up to the SDK maximum so
+        # short queries come back finished without any polling at all.
+        statement = await loop.run_in_executor(
+            None,
+            functools.partial(
+                workspace.statement_execution.execute_statement,
                 statement=query,
-                wait_timeout="30s"
+                warehouse_id=warehouse_id,
+                wait_timeout="50s",
+                format=Format.ARROW_STREAM,
+                disposition=Disposition.EXTERNAL_LINKS,
+                row_limit=max_rows
             )
         )
 
         async def poll_results():
-            while statement.status.state in ["PENDING", "RUNNING"]:
-                await asyncio.sleep(2)
-                statement.refresh()
-            if statement.status.state != "SUCCEEDED":
+            nonlocal statement
+            delay = POLL_INITIAL_DELAY
+            while statement.status.state in PENDING_STATES:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, POLL_MAX_DELAY)
+                statement = await loop.run_in_executor(
+                    None,
+                    workspace.statement_execution.get_statement,
+                    statement.statement_id
+                )
+            if statement.status.state != StatementState.SUCCEEDED:
                 raise RuntimeError(f"Query failed: {statement.status.error}")
-            return statement.result.data_array or []
-
-        results = await poll_results()
+            return await loop.run_in_executor(None, _fetch_arrow_result, statement)
 
-        if results and statement.result.schema:
-            columns = [field.name for field in statement.result.schema.fields]
-            return [dict(zip(columns, row)) for row in results]
-        return []
+        table = await poll_results()
+        return {
+            "rows": table.to_pylist() if table is not None else [],
+            "truncated": bool(statement.manifest and statement.manifest.truncated)
+        }
 
     except Exception as e:
         raise RuntimeError(f"SQL query failed: {str(e)}")
 
+def _connect_snowflake():
+    """Opens a new Snowflake connection from the SNOWFLAKE_* env vars."""
+    import snowflake.connector
+
+    # Gather credentials from environment
+    account = os.getenv("SNOWFLAKE_ACCOUNT")
+    user = os.getenv("SNOWFLAKE_USER")
+    password = os.getenv("SNOWFLAKE_PASSWORD")
+    database = os.getenv("SNOWFLAKE_DATABASE")
+    schema = os.getenv("SNOWFLAKE_SCHEMA")
+    warehouse = os.getenv("SNOWFLAKE_WAREHOUSE")
+
+    if not all([account, user, password, database, schema, warehouse]):
+        raise ValueError("Missing one or more Snowflake environment variables.")
+
+    return snowflake.connector.connect(
+        account=account,
+        user=user,
+        password=password,
+        database=database,
+        schema=schema,
+        warehouse=warehouse,
+        autocommit=True,
+        # Pooled connections can sit idle for hours; keep their session alive
+        client_session_keep_alive=True,
+    )
+
+def _close_snowflake(conn):
+    """Closes a Snowflake connection, ignoring errors from an already-dead one."""
+    if conn is not None:
+        with contextlib.suppress(Exception):
+            conn.close()
+
+def _run_snowflake_query_sync(conn, query: str) -> List[Dict[str, Any]]:
+    """Runs a query on a Snowflake connection and returns rows as dicts."""
+    import snowflake.connector
+
+    with conn.cursor() as cur:
+        cur.execute(query)
+        if not cur.description:
+            return []
+        try:
+            # Results arrive as Arrow; skip the per-row tuple round trip.
+            # TIMESTAMP(9) would be timestamp[ns], which to_pylist()
+            # can't convert without pandas.
+            table = cur.fetch_arrow_all(force_microsecond_precision=True)
+        except snowflake.connector.errors.NotSupportedError:
+            # Non-Arrow result sets (e.g. SHOW commands)
+            columns = [desc[0] for desc in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+        return table.to_pylist() if table is not None else []
+
+async def _get_sf_pool() -> asyncio.Queue:
+    """Returns the shared Snowflake connection pool, filling it on first use."""
+    global SF_POOL
+    async with _sf_pool_lock:
+        if SF_POOL is None:
+            loop = asyncio.get_running_loop()
+            conns = await asyncio.gather(
+                *(loop.run_in_executor(_SF_EXECUTOR, _connect_snowflake) for _ in range(SF_POOL_SIZE)),
+                return_exceptions=True
+            )
+            pool = asyncio.Queue(maxsize=SF_POOL_SIZE)
+            for conn in conns:
+                # Failed connects leave an empty slot that reconnects on use
+                pool.put_nowait(None if isinstance(conn, BaseException) else conn)
+            SF_POOL = pool
+    return SF_POOL
+
 @mcp.tool()
 async def run_snowflake_query(query: str) -> List[Dict[str, Any]]:
     """
     Runs a SQL query on Snowflake and returns results.
     Requires SNOWFLAKE_ACCOUNT, SNOWFLAKE_USER, SNOWFLAKE_PASSWORD, SNOWFLAKE_DATABASE, SNOWFLAKE_SCHEMA, SNOWFLAKE_WAREHOUSE env vars.
+    Connections are pooled across calls; SF_POOL_SIZE sets the pool size (default 5).
     """
     try:
         import snowflake.connector
-        import asyncio
-
-        # Gather credentials from environment
-        account = os.getenv("SNOWFLAKE_ACCOUNT")
-        user = os.getenv("SNOWFLAKE_USER")
-        password = os.getenv("SNOWFLAKE_PASSWORD")
-        database = os.getenv("SNOWFLAKE_DATABASE")
-        schema = os.getenv("SNOWFLAKE_SCHEMA")
-        warehouse = os.getenv("SNOWFLAKE_WAREHOUSE")
-
-        if not all([account, user, password, database, schema, warehouse]):
-            raise ValueError("Missing one or more Snowflake environment variables.")
-
-        # Connect to Snowflake
-        conn = snowflake.connector.connect(
-            account=account,
-            user=user,
-            password=password,
-            database=database,
-            schema=schema,
-            warehouse=warehouse,
-            autocommit=True,
-        )
 
-        def run_query_sync(q):
-            with conn.cursor() as cur:
-                cur.execute(q)
-                columns = [desc[0] for desc in cur.description] if cur.description else []
-                rows = cur.fetchall()
-                return [dict(zip(columns, row)) for row in rows] if columns else []
-
-        loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(None, run_query_sync, query)
-        conn.close()
-        return results
+        loop = asyncio.get_running_loop()
+        pool = await _get_sf_pool()
+        conn = await pool.get()
+        try:
+            # A slot is left empty (None) when its connection was discarded
+            if conn is None or conn.is_closed():
+                conn = await loop.run_in_executor(_SF_EXECUTOR, _connect_snowflake)
+
+            try:
+                return await loop.run_in_executor(_SF_EXECUTOR, _run_snowflake_query_sync, conn, query)
+            except snowflake.connector.errors.ProgrammingError as e:
+                if e.errno not in _SF_SESSION_EXPIRED_ERRNOS:
+                    raise
+                # The pooled session expired before the query ran; reconnect
+                # and retry once rather than failing the caller.
+                _close_snowflake(conn)
+                conn = None
+                conn = await loop.run_in_executor(_SF_EXECUTOR, _connect_snowflake)
+                return await loop.run_in_executor(_SF_EXECUTOR, _run_snowflake_query_sync, conn, query)
+        except asyncio.CancelledError:
+            # The query may still be running on the executor thread; never hand
+            # this connection to another caller.
+            _SF_EXECUTOR.submit(_close_snowflake, conn)
+            conn = None
+            raise
+        except snowflake.connector.errors.Error as e:
+            # Broken or expired connection: drop it so the next caller reconnects
+            if (
+                isinstance(e, snowflake.connector.errors.OperationalError)
+                or e.errno in _SF_SESSION_EXPIRED_ERRNOS
+            ):
+                _close_snowflake(conn)
+                conn = None
+            raise
+        finally:
+            pool.put_nowait(conn)
 
     except Exception as e:
         raise RuntimeError(f"Snowflake query failed: {str(e)}")
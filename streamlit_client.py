@@ -1,31 +1,79 @@
 import streamlit as st
-import asyncio
 import re
+import orjson
 import requests
 import os
-from fastmcp import Client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from mcp_connection import call_tool
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize FastMCP client
-client = Client("toll_server.py")
+# Chat command patterns
+_RE_VEHICLE = re.compile(r"for\s+(\w+)")
+_RE_DISTANCE = re.compile(r"(\d+\.?\d*)\s+miles")
+_RE_RATE = re.compile(r"\$?(\d+\.?\d*)\s*/?\s*mile")
+_RE_SQL = re.compile(r"run sql query\s+(.+)", re.IGNORECASE)
+
+# secret_word and calculate_toll are pure, so repeat calls are answered from
+# session state without a round trip to the server.
+TOLL_CACHE_SIZE = 128
+
+def get_secret_word():
+    if "secret_word" not in st.session_state:
+        st.session_state.secret_word = call_tool("secret_word")
+    return st.session_state.secret_word
+
+def get_toll(vehicle_type: str, distance: float, toll_rate: float):
+    # Round the floats so equal inputs from widgets/regexes share a key
+    key = (vehicle_type.lower(), round(distance, 4), round(toll_rate, 4))
+    cache = st.session_state.setdefault("toll_cache", {})
+    if key not in cache:
+        if len(cache) >= TOLL_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+        cache[key] = call_tool(
+            "calculate_toll",
+            {"vehicle_type": key[0], "distance": distance, "toll_rate": toll_rate}
+        )
+    return cache[key]
 
 # Initialize session state for chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-# Function to generate SQL query using custom NLP gateway
-def generate_sql_query(natural_language: str) -> str:
-    gateway_url = os.getenv("NLP_GATEWAY_URL")
-    model_name = os.getenv("NLP_MODEL_NAME")
-    api_key = os.getenv("NLP_API_KEY")  # Optional
+# Shared keep-alive session for the NLP gateway. Streamlit re-executes this
+# script on every interaction, so cache it as a resource rather than rebuilding
+# it at module scope.
+@st.cache_resource
+def get_nlp_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        # read=0: never resend a request the gateway may already be running
+        max_retries=Retry(
+            total=2,
+            read=0,
+            backoff_factor=0.3,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=frozenset(["POST"])
+        )
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-    if not gateway_url or not model_name:
-        raise ValueError("NLP_GATEWAY_URL and NLP_MODEL_NAME must be set")
+def _completion_text(data) -> str:
+    """Extracts the completion text from an OpenAI-style gateway response."""
+    try:
+        return data["choices"][0]["text"].strip()
+    except (KeyError, IndexError, TypeError, AttributeError):
+        raise ValueError(f"Unexpected NLP gateway response shape: {str(data)[:200]}")
 
-    prompt = f"""
+# Static parts of the NL-to-SQL prompt; only the user's request varies per call
+_NLP_PROMPT_PREFIX = """
     Convert the following natural language request into a valid SQL query for a Databricks SQL warehouse.
     Assume tables are in a Unity Catalog schema (e.g., my_catalog.my_schema.table_name).
     Use standard SQL syntax and include a LIMIT 10 clause unless specified otherwise.
@@ -33,13 +81,33 @@ def generate_sql_query(natural_language: str) -> str:
     Examples:
     - "Show all customers" -> "SELECT * FROM my_catalog.my_schema.customers LIMIT 10"
     - "Get total tolls for cars in January 2025" -> "SELECT SUM(toll_amount) FROM my_catalog.my_schema.tolls WHERE vehicle_type = 'car' AND date LIKE '2025-01%' LIMIT 10"
-    Input: {natural_language}
+    Input: """
+_NLP_PROMPT_SUFFIX = """
     Output: Only the SQL query, no explanations.
     """
 
+# Function to generate SQL query using custom NLP gateway
+def generate_sql_query(natural_language: str) -> str:
+    gateway_url = os.getenv("NLP_GATEWAY_URL")
+    model_name = os.getenv("NLP_MODEL_NAME")
+    api_key = os.getenv("NLP_API_KEY")  # Optional
+
+    if not gateway_url or not model_name:
+        raise ValueError("NLP_GATEWAY_URL and NLP_MODEL_NAME must be set")
+
+    # Collapse case/whitespace so near-identical requests share a cache entry
+    normalized = " ".join(natural_language.lower().split())
+    return _translate_to_sql(normalized, gateway_url, model_name, api_key)
+
+# Gateway translations are cached across reruns and sessions, keyed by the
+# normalized request, gateway and model (the API key is left out of the hash).
+@st.cache_data(max_entries=512, show_spinner=False)
+def _translate_to_sql(natural_language: str, gateway_url: str, model_name: str, _api_key: str) -> str:
+    prompt = _NLP_PROMPT_PREFIX + natural_language + _NLP_PROMPT_SUFFIX
+
     headers = {"Content-Type": "application/json"}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
+    if _api_key:
+        headers["Authorization"] = f"Bearer {_api_key}"
 
     payload = {
         "model": model_name,
@@ -48,14 +116,24 @@ def generate_sql_query(natural_language: str) -> str:
     }
 
     try:
-        response = requests.post(gateway_url, json=payload, headers=headers)
+        # (connect, read) timeouts so a stuck gateway can't hang the app
+        response = get_nlp_session().post(gateway_url, json=payload, headers=headers, timeout=(3.05, 30))
         response.raise_for_status()
         # Adjust parsing based on your gateway's response format
         # Example assumes OpenAI-like response
-        return response.json().get("choices", [{}])[0].get("text", "").strip()
+        return _completion_text(orjson.loads(response.content))
     except Exception as e:
         raise RuntimeError(f"Failed to generate SQL query: {str(e)}")
 
+# run_sql_query returns {"rows": [...], "truncated": bool}
+def format_sql_results(results) -> str:
+    if not results["rows"]:
+        return "No results returned."
+    text = "\n".join([str(row) for row in results["rows"]])
+    if results["truncated"]:
+        text += f"\n(Showing the first {len(results['rows'])} rows; the query returned more.)"
+    return text
+
 st.title("Toll Server Tools")
 
 # Chat Interface
@@ -80,51 +158,42 @@ if user_input:
 
     # Parse and process command
     try:
-        async def process_command(command):
-            async with client:
-                command = command.lower().strip()
-                # Handle secret_word
-                if "secret word" in command:
-                    return await client.call_tool("secret_word")
-                # Handle calculate_toll
-                elif "calculate toll" in command:
-                    vehicle_match = re.search(r"for\s+(\w+)", command)
-                    distance_match = re.search(r"(\d+\.?\d*)\s+miles", command)
-                    rate_match = re.search(r"\$?(\d+\.?\d*)\s*/?\s*mile", command)
-
-                    vehicle_type = vehicle_match.group(1) if vehicle_match else "car"
-                    distance = float(distance_match.group(1)) if distance_match else 10.0
-                    toll_rate = float(rate_match.group(1)) if rate_match else 0.25
-
-                    return await client.call_tool(
-                        "calculate_toll",
-                        {"vehicle_type": vehicle_type, "distance": distance, "toll_rate": toll_rate}
-                    )
-                # Handle run_sql_query (direct SQL)
-                elif "run sql query" in command:
-                    query_match = re.search(r"run sql query\s+(.+)", command, re.IGNORECASE)
-                    if not query_match:
-                        return "Please provide a SQL query (e.g., 'Run SQL query SELECT * FROM my_table')."
-                    query = query_match.group(1).strip()
-                    results = await client.call_tool("run_sql_query", {"query": query})
-                    if results:
-                        return "\n".join([str(row) for row in results])
-                    return "No results returned."
-                # Handle NLP for SQL query
-                else:
-                    # Generate SQL query via custom gateway
-                    query = generate_sql_query(command)
-                    st.session_state.messages.append({"role": "assistant", "content": f"Generated SQL: {query}"})
-                    with chat_container:
-                        with st.chat_message("assistant"):
-                            st.markdown(f"Generated SQL: {query}")
-                    results = await client.call_tool("run_sql_query", {"query": query})
-                    if results:
-                        return "\n".join([str(row) for row in results])
-                    return "No results returned."
-
-        # Run async command
-        response = asyncio.run(process_command(user_input))
+        def process_command(command):
+            command = command.lower().strip()
+            # Handle secret_word
+            if "secret word" in command:
+                return get_secret_word()
+            # Handle calculate_toll
+            elif "calculate toll" in command:
+                vehicle_match = _RE_VEHICLE.search(command)
+                distance_match = _RE_DISTANCE.search(command)
+                rate_match = _RE_RATE.search(command)
+
+                vehicle_type = vehicle_match.group(1) if vehicle_match else "car"
+                distance = float(distance_match.group(1)) if distance_match else 10.0
+                toll_rate = float(rate_match.group(1)) if rate_match else 0.25
+
+                return get_toll(vehicle_type, distance, toll_rate)
+            # Handle run_sql_query (direct SQL)
+            elif "run sql query" in command:
+                query_match = _RE_SQL.search(command)
+                if not query_match:
+                    return "Please provide a SQL query (e.g., 'Run SQL query SELECT * FROM my_table')."
+                query = query_match.group(1).strip()
+                results = call_tool("run_sql_query", {"query": query})
+                return format_sql_results(results)
+            # Handle NLP for SQL query
+            else:
+                # Generate SQL query via custom gateway
+                query = generate_sql_query(command)
+                st.session_state.messages.append({"role": "assistant", "content": f"Generated SQL: {query}"})
+                with chat_container:
+                    with st.chat_message("assistant"):
+                        st.markdown(f"Generated SQL: {query}")
+                results = call_tool("run_sql_query", {"query": query})
+                return format_sql_results(results)
+
+        response = process_command(user_input)
 
         # Add assistant response to history
         st.session_state.messages.append({"role": "assistant", "content": str(response)})
@@ -144,10 +213,7 @@ st.header("Manual Tool Access")
 st.subheader("Get Secret Word")
 if st.button("Get Secret Word"):
     try:
-        async def call_secret_word():
-            async with client:
-                return await client.call_tool("secret_word")
-        result = asyncio.run(call_secret_word())
+        result = get_secret_word()
         st.success(f"Secret Word: {result}")
     except Exception as e:
         st.error(f"Error: {e}")
@@ -159,13 +225,7 @@ toll_rate = st.number_input("Toll Rate ($/mile)", min_value=0.0, step=0.01, valu
 
 if st.button("Calculate Toll"):
     try:
-        async def call_calculate_toll():
-            async with client:
-                return await client.call_tool(
-                    "calculate_toll",
-                    {"vehicle_type": vehicle_type.lower(), "distance": distance, "toll_rate": toll_rate}
-                )
-        result = asyncio.run(call_calculate_toll())
+        result = get_toll(vehicle_type, distance, toll_rate)
         st.success(f"Toll Cost: ${result}")
     except Exception as e:
         st.error(f"Error: {e}")
@@ -174,13 +234,12 @@ st.subheader("Run SQL Query")
 sql_query = st.text_input("SQL Query (e.g., SELECT * FROM my_catalog.my_schema.my_table LIMIT 10)")
 if st.button("Execute SQL Query"):
     try:
-        async def call_sql_query():
-            async with client:
-                return await client.call_tool("run_sql_query", {"query": sql_query})
-        results = asyncio.run(call_sql_query())
-        if results:
+        results = call_tool("run_sql_query", {"query": sql_query})
+        if results["rows"]:
             st.success("Query Results:")
-            st.write(results)
+            st.write(results["rows"])
+            if results["truncated"]:
+                st.warning(f"Showing the first {len(results['rows'])} rows; the query returned more.")
         else:
             st.info("No results returned.")
     except Exception as e:
@@ -191,11 +250,8 @@ st.subheader("Call Snowflake Agent")
 sf_query = st.text_input("Snowflake SQL Query (e.g., SELECT * FROM my_db.my_schema.my_table LIMIT 10)", key="sf_query")
 if st.button("Execute Snowflake Query"):
     try:
-        async def call_snowflake_agent():
-            async with client:
-                # Assumes you have a tool named 'run_snowflake_query' registered in your FastMCP server
-                return await client.call_tool("run_snowflake_query", {"query": sf_query})
-        sf_results = asyncio.run(call_snowflake_agent())
+        # Assumes you have a tool named 'run_snowflake_query' registered in your FastMCP server
+        sf_results = call_tool("run_snowflake_query", {"query": sf_query})
         if sf_results:
             st.success("Snowflake Query Results:")
             st.write(sf_results)
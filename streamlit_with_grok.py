@@ -1,17 +1,13 @@
 import streamlit as st
-import asyncio
 import re
 import requests
 import os
-from fastmcp import Client
+from mcp_connection import call_tool
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize FastMCP client
-client = Client("toll_server.py")
-
 # Initialize session state for chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -49,6 +45,15 @@ def generate_sql_query(natural_language: str) -> str:
     except Exception as e:
         raise RuntimeError(f"Failed to generate SQL query: {str(e)}")
 
+# run_sql_query returns {"rows": [...], "truncated": bool}
+def format_sql_results(results) -> str:
+    if not results["rows"]:
+        return "No results returned."
+    text = "\n".join([str(row) for row in results["rows"]])
+    if results["truncated"]:
+        text += f"\n(Showing the first {len(results['rows'])} rows; the query returned more.)"
+    return text
+
 st.title("Toll Server Tools")
 
 # Chat Interface
@@ -73,51 +78,45 @@ if user_input:
 
     # Parse and process command
     try:
-        async def process_command(command):
-            async with client:
-                command = command.lower().strip()
-                # Handle secret_word
-                if "secret word" in command:
-                    return await client.call_tool("secret_word")
-                # Handle calculate_toll
-                elif "calculate toll" in command:
-                    vehicle_match = re.search(r"for\s+(\w+)", command)
-                    distance_match = re.search(r"(\d+\.?\d*)\s+miles", command)
-                    rate_match = re.search(r"\$?(\d+\.?\d*)\s*/?\s*mile", command)
-
-                    vehicle_type = vehicle_match.group(1) if vehicle_match else "car"
-                    distance = float(distance_match.group(1)) if distance_match else 10.0
-                    toll_rate = float(rate_match.group(1)) if rate_match else 0.25
-
-                    return await client.call_tool(
-                        "calculate_toll",
-                        {"vehicle_type": vehicle_type, "distance": distance, "toll_rate": toll_rate}
-                    )
-                # Handle run_sql_query (NLP or direct)
-                elif "run sql query" in command:
-                    query_match = re.search(r"run sql query\s+(.+)", command, re.IGNORECASE)
-                    if not query_match:
-                        return "Please provide a SQL query (e.g., 'Run SQL query SELECT * FROM my_table')."
-                    query = query_match.group(1).strip()
-                    results = await client.call_tool("run_sql_query", {"query": query})
-                    if results:
-                        return "\n".join([str(row) for row in results])
-                    return "No results returned."
-                # Handle NLP for SQL query
-                else:
-                    # Assume natural language input is for SQL query
-                    query = generate_sql_query(command)
-                    st.session_state.messages.append({"role": "assistant", "content": f"Generated SQL: {query}"})
-                    with chat_container:
-                        with st.chat_message("assistant"):
-                            st.markdown(f"Generated SQL: {query}")
-                    results = await client.call_tool("run_sql_query", {"query": query})
-                    if results:
-                        return "\n".join([str(row) for row in results])
-                    return "No results returned."
-
-        # Run async command
-        response = asyncio.run(process_command(user_input))
+        def process_command(command):
+            command = command.lower().strip()
+            # Handle secret_word
+            if "secret word" in command:
+                return call_tool("secret_word")
+            # Handle calculate_toll
+            elif "calculate toll" in command:
+                vehicle_match = re.search(r"for\s+(\w+)", command)
+                distance_match = re.search(r"(\d+\.?\d*)\s+miles", command)
+                rate_match = re.search(r"\$?(\d+\.?\d*)\s*/?\s*mile", command)
+
+                vehicle_type = vehicle_match.group(1) if vehicle_match else "car"
+                distance = float(distance_match.group(1)) if distance_match else 10.0
+                toll_rate = float(rate_match.group(1)) if rate_match else 0.25
+
+                return call_tool(
+                    "calculate_toll",
+                    {"vehicle_type": vehicle_type, "distance": distance, "toll_rate": toll_rate}
+                )
+            # Handle run_sql_query (NLP or direct)
+            elif "run sql query" in command:
+                query_match = re.search(r"run sql query\s+(.+)", command, re.IGNORECASE)
+                if not query_match:
+                    return "Please provide a SQL query (e.g., 'Run SQL query SELECT * FROM my_table')."
+                query = query_match.group(1).strip()
+                results = call_tool("run_sql_query", {"query": query})
+                return format_sql_results(results)
+            # Handle NLP for SQL query
+            else:
+                # Assume natural language input is for SQL query
+                query = generate_sql_query(command)
+                st.session_state.messages.append({"role": "assistant", "content": f"Generated SQL: {query}"})
+                with chat_container:
+                    with st.chat_message("assistant"):
+                        st.markdown(f"Generated SQL: {query}")
+                results = call_tool("run_sql_query", {"query": query})
+                return format_sql_results(results)
+
+        response = process_command(user_input)
 
         # Add assistant response to history
         st.session_state.messages.append({"role": "assistant", "content": str(response)})
@@ -137,10 +136,7 @@ st.header("Manual Tool Access")
 st.subheader("Get Secret Word")
 if st.button("Get Secret Word"):
     try:
-        async def call_secret_word():
-            async with client:
-                return await client.call_tool("secret_word")
-        result = asyncio.run(call_secret_word())
+        result = call_tool("secret_word")
         st.success(f"Secret Word: {result}")
     except Exception as e:
         st.error(f"Error: {e}")
@@ -152,13 +148,10 @@ toll_rate = st.number_input("Toll Rate ($/mile)", min_value=0.0, step=0.01, valu
 
 if st.button("Calculate Toll"):
     try:
-        async def call_calculate_toll():
-            async with client:
-                return await client.call_tool(
-                    "calculate_toll",
-                    {"vehicle_type": vehicle_type.lower(), "distance": distance, "toll_rate": toll_rate}
-                )
-        result = asyncio.run(call_calculate_toll())
+        result = call_tool(
+            "calculate_toll",
+            {"vehicle_type": vehicle_type.lower(), "distance": distance, "toll_rate": toll_rate}
+        )
         st.success(f"Toll Cost: ${result}")
     except Exception as e:
         st.error(f"Error: {e}")
@@ -167,13 +160,12 @@ st.subheader("Run SQL Query")
 sql_query = st.text_input("SQL Query (e.g., SELECT * FROM my_catalog.my_schema.my_table LIMIT 10)")
 if st.button("Execute SQL Query"):
     try:
-        async def call_sql_query():
-            async with client:
-                return await client.call_tool("run_sql_query", {"query": sql_query})
-        results = asyncio.run(call_sql_query())
-        if results:
+        results = call_tool("run_sql_query", {"query": sql_query})
+        if results["rows"]:
             st.success("Query Results:")
-            st.write(results)
+            st.write(results["rows"])
+            if results["truncated"]:
+                st.warning(f"Showing the first {len(results['rows'])} rows; the query returned more.")
         else:
             st.info("No results returned.")
     except Exception as e:
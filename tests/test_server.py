@@ -0,0 +1,22 @@
+import itertools
+
+from server import calculate_toll, calculate_tolls_batch
+
+
+def _fn(tool):
+    # @mcp.tool() wraps the function in a Tool object in fastmcp 2.x
+    return getattr(tool, "fn", tool)
+
+
+def test_calculate_tolls_batch_matches_calculate_toll():
+    vehicle_types = ["car", "truck", "motorcycle", "bus"]
+    distances = [i / 10 for i in range(0, 10000, 7)]
+    for toll_rate in [0.1, 0.2, 0.25, 0.33]:
+        pairs = list(itertools.product(vehicle_types, distances))
+        batch = _fn(calculate_tolls_batch)([v for v, _ in pairs], [d for _, d in pairs], toll_rate)
+        single = [_fn(calculate_toll)(v, d, toll_rate) for v, d in pairs]
+        assert batch == single
+
+
+def test_calculate_tolls_batch_rounds_like_round():
+    assert _fn(calculate_tolls_batch)(["car"], [0.1]) == [_fn(calculate_toll)("car", 0.1)] == [0.03]